@@ -1,7 +1,19 @@
-from flask import Flask, jsonify,request, g
+from flask import Flask, Response, jsonify,request, g
 from flask_cors import CORS  # Import CORS
+from flask_caching import Cache
+from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import datetime
+import atexit
+import orjson
+import os
+import queue
 import requests
+from requests.adapters import HTTPAdapter
+import signal
 import sqlite3
+import sys
+import threading
+from urllib3.util.retry import Retry
 
 app = Flask(__name__)
 # Configure CORS settings
@@ -9,20 +21,95 @@ app.config['CORS_RESOURCES'] = {r"/*": {"origins": "*"}}
 app.config['CORS_HEADERS'] = 'Content-Type'
 app.config['CORS_METHODS'] = ['GET', 'POST', 'PUT', 'DELETE']
 cors = CORS(app)
+# GET responses are cached in memory and invalidated whenever the data changes
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 300})
 
-DATABASE = "events.db"
+# Kept in its own directory in Docker so the WAL and shared-memory files that
+# SQLite writes next to it are persisted along with the database
+DATABASE = os.environ.get("DATABASE", "events.db")
+
+# One keep-alive session shared by every GBF Wiki request
+WIKI_API_URL = "https://gbf.wiki/api.php"
+SESSION = requests.Session()
+SESSION.headers.update({
+    "User-Agent": "MyProjectBot/1.0 (contact@example.com)",
+    "Accept-Encoding": "gzip"
+})
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                      max_retries=Retry(total=3, backoff_factor=0.3)))
+
+# Wiki data is refreshed off the request threads by a background scheduler
+REFRESH_INTERVAL_MINUTES = 15
+scheduler = BackgroundScheduler()
+# Rows stored by the most recent successful refresh, returned by the update routes
+_last_refresh = {'events': [], 'characters': []}
+
+# Connection tuning applied to every new SQLite connection.
+# WAL lets readers run alongside a writer, and synchronous=NORMAL is safe in WAL mode.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',  # 64 MiB page cache
+    'PRAGMA mmap_size=268435456',  # 256 MiB memory-mapped I/O
+    'PRAGMA busy_timeout=30000',
+)
+OPTIMIZE_EVERY_N_REQUESTS = 500  # Run PRAGMA optimize after this many returned connections
+DB_POOL_SIZE = 8
+_returned_connections = 0
 
 # ------------------- Database Functions -------------------
+def connect_db():
+    """Open a new SQLite connection with the tuning PRAGMAs applied."""
+    db = sqlite3.connect(DATABASE, check_same_thread=False)
+    db.row_factory = sqlite3.Row  # Rows convert to dicts with a plain dict(row)
+    for pragma in SQLITE_PRAGMAS:
+        db.execute(pragma)
+    return db
+
+# Long-lived connections shared between requests keep SQLite's page cache warm.
+# Up to DB_POOL_SIZE requests can read at once, but writes go through _db_write_lock
+# so only one connection writes at a time.
+_db_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+for _ in range(DB_POOL_SIZE):
+    _db_pool.put(connect_db())
+_db_write_lock = threading.Lock()
+
+def checkpoint_db():
+    """Fold the WAL back into the database file and close the pooled connections."""
+    db = connect_db()
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    db.close()
+    while not _db_pool.empty():
+        _db_pool.get_nowait().close()
+
 def get_db():
-    """Connect to SQLite database."""
+    """Check out a pooled SQLite connection for the current app context."""
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = g._database = _db_pool.get()
     return db
 
+# Bumped on every write. The version is part of the GET routes' cache keys, so
+# a response cached while a write was committing is never served after it, and
+# the serialized bodies kept in app.config are rebuilt only when it changes
+_table_versions = {'events': 0, 'characters': 0}
+
+def json_response(obj, status=200):
+    """Build a JSON response with orjson, which encodes straight to bytes."""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def invalidate_events_cache():
+    """Retire the cached /events response after the events table changes."""
+    _table_versions['events'] += 1
+
+def invalidate_characters_cache():
+    """Retire the cached /characters response after the characters table changes."""
+    _table_versions['characters'] += 1
+
 def create_table():
-    """Create events table if not exists."""
-    with get_db() as db:
+    """Create tables and indexes if not exists, returning the duplicates removed first."""
+    with _db_write_lock, get_db() as db:
         db.execute('''CREATE TABLE IF NOT EXISTS events (
                         id INTEGER PRIMARY KEY,
                         name TEXT,
@@ -38,83 +125,104 @@ def create_table():
                         gw_rating_fa REAL,
                         gw_rating_hl REAL
                     )''')
-        
+
+        # Databases created before the unique indexes existed may hold duplicates,
+        # which would make CREATE UNIQUE INDEX fail, so remove them first
+        duplicates_deleted = delete_duplicates(db)
+
+        # Unique indexes used as conflict targets by save_events and save_characters
+        db.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ux_events
+                      ON events(name, time_start, IFNULL(time_end, ''))''')
+        db.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ux_chars
+                      ON characters(name, element)''')
+
+        # Serve the ORDER BY of GET /events and the element filter of the recommender
+        db.execute('CREATE INDEX IF NOT EXISTS ix_events_time_start ON events(time_start)')
+        db.execute('CREATE INDEX IF NOT EXISTS ix_chars_element ON characters(element)')
+    return duplicates_deleted
+
+def delete_duplicates(db):
+    """Delete duplicate events and characters, keeping the lowest ID of each group."""
+    changes_before = db.total_changes
+    db.execute('''DELETE FROM events WHERE id NOT IN (
+                    SELECT MIN(id) FROM events
+                    GROUP BY name, time_start, IFNULL(time_end, ''))''')
+    events_deleted = db.total_changes - changes_before
+
+    changes_before = db.total_changes
+    db.execute('''DELETE FROM characters WHERE id NOT IN (
+                    SELECT MIN(id) FROM characters
+                    GROUP BY name, element)''')
+    characters_deleted = db.total_changes - changes_before
+
+    return events_deleted, characters_deleted
+
 def update_event(event_id, name, time_start, time_end):
     """Update event in the database."""
-    with get_db() as db:
+    with _db_write_lock, get_db() as db:
         db.execute('''UPDATE events 
                       SET name = ?, time_start = ?, time_end = ? 
                       WHERE id = ?''', (name, time_start, time_end, event_id))
         db.commit()
+    invalidate_events_cache()
 
 def save_events(events):
     """Save events to database."""
-    with get_db() as db:
-        # First, check for existing events and only insert new ones
-        for event in events:
-            name, time_start, time_end = event
-            # Check if this event already exists, handling NULL values properly
-            if time_end:
-                cursor = db.execute(
-                    'SELECT id FROM events WHERE name = ? AND time_start = ? AND time_end = ?',
-                    (name, time_start, time_end)
-                )
-            else:
-                cursor = db.execute(
-                    'SELECT id FROM events WHERE name = ? AND time_start = ? AND (time_end IS NULL OR time_end = "")',
-                    (name, time_start)
-                )
-            
-            if not cursor.fetchone():
-                # Event doesn't exist, insert it
-                db.execute(
-                    'INSERT INTO events (name, time_start, time_end) VALUES (?, ?, ?)',
-                    (name, time_start, time_end)
-                )
+    with _db_write_lock, get_db() as db:
+        # Insert all events in one write transaction, skipping the ones already stored.
+        # IFNULL(time_end, '') treats NULL and empty end times as the same event.
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany(
+            '''INSERT INTO events (name, time_start, time_end) VALUES (?, ?, ?)
+               ON CONFLICT(name, time_start, IFNULL(time_end, '')) DO NOTHING''',
+            events
+        )
         db.commit()
+    invalidate_events_cache()
 
 def get_stored_events():
     """Retrieve stored events from database."""
     with get_db() as db:
         cur = db.execute('SELECT name, time_start, time_end FROM events')
-        return [{"name": row[0], "time_start": row[1], "time_end": row[2]} for row in cur.fetchall()]
+        return [dict(row) for row in cur]
 
 def save_characters(characters):
     """Save characters to the database."""
-    with get_db() as db:
-        # Check for existing characters and only insert new ones
-        for character in characters:
-            name, element, gw_rating, gw_rating_grind, gw_rating_fa, gw_rating_hl = character
-            # Check if this character already exists
-            cursor = db.execute('SELECT id FROM characters WHERE name = ? AND element = ?', (name, element))
-            if cursor.fetchone():
-                # Character exists, update it
-                db.execute('''UPDATE characters 
-                              SET gw_rating = ?, gw_rating_grind = ?, gw_rating_fa = ?, gw_rating_hl = ? 
-                              WHERE name = ? AND element = ?''', 
-                           (gw_rating, gw_rating_grind, gw_rating_fa, gw_rating_hl, name, element))
-            else:
-                # Character doesn't exist, insert it
-                db.execute('''INSERT INTO characters 
-                              (name, element, gw_rating, gw_rating_grind, gw_rating_fa, gw_rating_hl) 
-                              VALUES (?, ?, ?, ?, ?, ?)''', character)
+    with _db_write_lock, get_db() as db:
+        # Insert new characters and update the ratings of existing ones in one write transaction
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany(
+            '''INSERT INTO characters
+               (name, element, gw_rating, gw_rating_grind, gw_rating_fa, gw_rating_hl)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(name, element) DO UPDATE SET
+                   gw_rating = excluded.gw_rating,
+                   gw_rating_grind = excluded.gw_rating_grind,
+                   gw_rating_fa = excluded.gw_rating_fa,
+                   gw_rating_hl = excluded.gw_rating_hl''',
+            characters
+        )
         db.commit()
+    invalidate_characters_cache()
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """Close database connection when app context ends."""
-    db = getattr(g, '_database', None)
+    """Return the database connection to the pool when app context ends."""
+    global _returned_connections
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        if db.in_transaction:
+            # Never hand a half-finished transaction to the next request
+            db.rollback()
+        _returned_connections += 1
+        if _returned_connections % OPTIMIZE_EVERY_N_REQUESTS == 0:
+            # Let SQLite refresh its query planner statistics now and then
+            db.execute('PRAGMA optimize')
+        _db_pool.put(db)
 
 # ------------------- Fetch Events from GBF Wiki -------------------
-@app.route('/update-events', methods=['POST'])
-def fetch_and_store_events():
-    """Fetch events from GBF Wiki and store in database."""
-    url = "https://gbf.wiki/api.php"
-    headers = {
-        "User-Agent": "MyProjectBot/1.0 (contact@example.com)"
-    }
+def _fetch_events():
+    """Fetch events from GBF Wiki as (name, time_start, time_end) tuples, or None on failure."""
     params = {
         'action': 'cargoquery',
         'format': 'json',
@@ -124,30 +232,39 @@ def fetch_and_store_events():
         'limit': '20'
     }
 
-    response = requests.get(url, params=params, headers=headers)
+    response = SESSION.get(WIKI_API_URL, params=params, timeout=10)
     if response.status_code == 200:
-        data = response.json()
+        data = orjson.loads(response.content)
         events = [
             (
-                event['title']['name'],
-                event['title']['time start'],
-                event['title'].get('time end', 'Ongoing')  # Handle missing end time
+                title['name'],
+                title['time start'],
+                title.get('time end', 'Ongoing')  # Handle missing end time
             )
-            for event in data['cargoquery']
+            for title in (event['title'] for event in data['cargoquery'])
         ]
-        
+        return events
+    print(f"Failed to retrieve events data: {response.status_code}")
+    return None
+
+def _refresh_events():
+    """Fetch events from GBF Wiki and store in database."""
+    events = _fetch_events()
+    if events is not None:
         # Store in DB
         save_events(events)
-        return jsonify({"message": "Events updated!", "events": events})
-    else:
-        return jsonify({"error": "Failed to retrieve data"}), response.status_code
+        _last_refresh['events'] = events
+        print(f"Successfully updated {len(events)} events")
+
+@app.route('/update-events', methods=['POST'])
+def fetch_and_store_events():
+    """Schedule an immediate background refresh of the events from GBF Wiki."""
+    schedule_refresh(_refresh_events)
+    return json_response({"message": "Events update scheduled", "events": _last_refresh['events']}, 202)
     
 # ------------------- Fetch and Store Character Data -------------------
-@app.route('/update-characters', methods=['POST'])
-def fetch_and_store_characters():
-    """Fetch character data from GBF Wiki and store in the database."""
-    url = "https://gbf.wiki/api.php"
-    headers = {"User-Agent": "MyProjectBot/1.0 (contact@example.com)"}
+def _fetch_characters():
+    """Fetch SSR character data and ratings from GBF Wiki as tuples, or None on failure."""
     params = {
         'action': 'cargoquery',
         'format': 'json',
@@ -161,59 +278,89 @@ def fetch_and_store_characters():
         'order_by': 'character_ratings.gw_rating+0 DESC'
     }
 
-    response = requests.get(url, params=params, headers=headers)
+    response = SESSION.get(WIKI_API_URL, params=params, timeout=10)
     if response.status_code == 200:
-        data = response.json()
+        data = orjson.loads(response.content)
+        # Empty ratings come back as '' and are stored as NULL
         characters = [
             (
-                char['title']['name'],
-                char['title']['element'],
-                char['title'].get('gw rating') if char['title'].get('gw rating') else None,
-                char['title'].get('gw rating grind') if char['title'].get('gw rating grind') else None,
-                char['title'].get('gw rating fa') if char['title'].get('gw rating fa') else None,
-                char['title'].get('gw rating hl') if char['title'].get('gw rating hl') else None
+                title['name'],
+                title['element'],
+                title.get('gw rating') or None,
+                title.get('gw rating grind') or None,
+                title.get('gw rating fa') or None,
+                title.get('gw rating hl') or None
             )
-            for char in data['cargoquery']
+            for title in (char['title'] for char in data['cargoquery'])
         ]
-        
+        return characters
+    print(f"Failed to retrieve character data: {response.status_code}")
+    return None
+
+def _refresh_characters():
+    """Fetch character data from GBF Wiki and store in the database."""
+    characters = _fetch_characters()
+    if characters is not None:
         # Store in DB
         save_characters(characters)
-        return jsonify({"message": "Characters updated!", "characters": characters})
-    else:
-        return jsonify({"error": "Failed to retrieve character data"}), response.status_code
+        _last_refresh['characters'] = characters
+        print(f"Successfully updated {len(characters)} characters")
+
+@app.route('/update-characters', methods=['POST'])
+def fetch_and_store_characters():
+    """Schedule an immediate background refresh of the character data from GBF Wiki."""
+    schedule_refresh(_refresh_characters)
+    return json_response({"message": "Characters update scheduled", "characters": _last_refresh['characters']}, 202)
+
+# ------------------- Background Refresh -------------------
+def _run_refresh(refresh):
+    """Run a refresh helper inside an app context, logging any failure."""
+    with app.app_context():
+        try:
+            refresh()
+        except Exception as e:
+            print(f"Error in {refresh.__name__}: {e}")
+
+def schedule_refresh(refresh):
+    """Queue a one-off run of a refresh helper on the background scheduler."""
+    scheduler.add_job(_run_refresh, args=[refresh], id=f"{refresh.__name__}_now",
+                      replace_existing=True)
+
+def start_scheduler():
+    """Refresh wiki data now and every REFRESH_INTERVAL_MINUTES in the background."""
+    for refresh in (_refresh_events, _refresh_characters):
+        scheduler.add_job(_run_refresh, 'interval', args=[refresh], id=refresh.__name__,
+                          minutes=REFRESH_INTERVAL_MINUTES, next_run_time=datetime.now())
+    scheduler.start()
 
 
 # ------------------- Get Stored Events -------------------
 @app.route('/events', methods=['GET'])
+@cache.cached(key_prefix=lambda: f"events:{_table_versions['events']}")
 def get_events():
     """Return stored events from database with event_id.""" 
-    with get_db() as db:
-        cursor = db.execute('SELECT id, name, time_start, time_end FROM events ORDER BY time_start DESC')
-        events = cursor.fetchall()
-
-    events_list = [{"event_id": event[0], "name": event[1], "time_start": event[2], "time_end": event[3]} for event in events]
-    return jsonify(events_list)
+    version = _table_versions['events']
+    cached = app.config.get('_events_json')
+    if cached is None or cached[0] != version:
+        with get_db() as db:
+            cursor = db.execute('SELECT id AS event_id, name, time_start, time_end FROM events ORDER BY time_start DESC')
+            events_list = [dict(event) for event in cursor]
+        cached = app.config['_events_json'] = (version, orjson.dumps(events_list))
+    return Response(cached[1], mimetype='application/json')
 
 # ------------------- Get Stored Characters -------------------
 @app.route('/characters', methods=['GET'])
+@cache.cached(key_prefix=lambda: f"characters:{_table_versions['characters']}")
 def get_characters():
     """Return stored characters from the database."""
-    with get_db() as db:
-        cur = db.execute('SELECT name, element, gw_rating, gw_rating_grind, gw_rating_fa, gw_rating_hl FROM characters')
-        characters = cur.fetchall()
-
-    characters_list = [
-        {
-            "name": char[0],
-            "element": char[1],
-            "gw_rating": char[2],
-            "gw_rating_grind": char[3],
-            "gw_rating_fa": char[4],
-            "gw_rating_hl": char[5]
-        }
-        for char in characters
-    ]
-    return jsonify(characters_list)
+    version = _table_versions['characters']
+    cached = app.config.get('_characters_json')
+    if cached is None or cached[0] != version:
+        with get_db() as db:
+            cur = db.execute('SELECT name, element, gw_rating, gw_rating_grind, gw_rating_fa, gw_rating_hl FROM characters')
+            characters_list = [dict(char) for char in cur]
+        cached = app.config['_characters_json'] = (version, orjson.dumps(characters_list))
+    return Response(cached[1], mimetype='application/json')
 
 # ------------------- Manually Add a New Event -------------------
 @app.route('/add-event', methods=['POST'])
@@ -225,10 +372,14 @@ def add_event():
     time_end = data.get('time_end', 'Ongoing')  # Default to 'Ongoing' if no end time is provided
 
     if name and time_start:
-        with get_db() as db:
-            db.execute('INSERT INTO events (name, time_start, time_end) VALUES (?, ?, ?)', 
-                       (name, time_start, time_end))
-            db.commit()
+        try:
+            with _db_write_lock, get_db() as db:
+                db.execute('INSERT INTO events (name, time_start, time_end) VALUES (?, ?, ?)',
+                           (name, time_start, time_end))
+                db.commit()
+        except sqlite3.IntegrityError:
+            return jsonify({"error": "An event with the same name and times already exists."}), 409
+        invalidate_events_cache()
         return jsonify({"message": "Event added successfully!"}), 201
     else:
         return jsonify({"error": "Missing required fields (name, time_start)."}), 400
@@ -243,7 +394,10 @@ def update_event_route(event_id):
     time_end = data.get('time_end', 'Ongoing')
 
     if name and time_start:
-        update_event(event_id, name, time_start, time_end)
+        try:
+            update_event(event_id, name, time_start, time_end)
+        except sqlite3.IntegrityError:
+            return jsonify({"error": "An event with the same name and times already exists."}), 409
         return jsonify({"message": "Event updated successfully!"})
     else:
         return jsonify({"error": "Missing required fields (name, time_start)."}), 400
@@ -252,7 +406,7 @@ def update_event_route(event_id):
 @app.route('/delete-event/<int:event_id>', methods=['DELETE'])
 def delete_event(event_id):
     """Delete an event from the database by its ID."""
-    with get_db() as db:
+    with _db_write_lock, get_db() as db:
         # Check if the event exists first
         cur = db.execute('SELECT id FROM events WHERE id = ?', (event_id,))
         event = cur.fetchone()
@@ -263,6 +417,7 @@ def delete_event(event_id):
         # If event exists, delete it
         db.execute('DELETE FROM events WHERE id = ?', (event_id,))
         db.commit()
+    invalidate_events_cache()
         
     return jsonify({"message": f"Event {event_id} deleted successfully."})
 
@@ -270,79 +425,14 @@ def delete_event(event_id):
 @app.route('/cleanup-duplicates', methods=['POST'])
 def cleanup_duplicates():
     """Remove duplicate entries from the database."""
-    with get_db() as db:
-        # For events, find records with duplicate content but different IDs
-        # This should only happen if there was a bug in the save_events function
-        # Use IFNULL to properly handle NULL values in time_end
-        cursor = db.execute('''
-            SELECT e1.id, e1.name, e1.time_start, e1.time_end
-            FROM events e1
-            JOIN (
-                SELECT name, time_start, IFNULL(time_end, '') as time_end, COUNT(*) as count
-                FROM events
-                GROUP BY name, time_start, IFNULL(time_end, '')
-                HAVING count > 1
-            ) e2 ON e1.name = e2.name AND e1.time_start = e2.time_start AND IFNULL(e1.time_end, '') = e2.time_end
-            ORDER BY e1.name, e1.time_start, e1.id
-        ''')
-        events_to_check = cursor.fetchall()
-        
-        # Group by content and keep only the lowest ID for each group
-        event_groups = {}
-        for event in events_to_check:
-            event_id, name, time_start, time_end = event
-            key = (name, time_start, time_end if time_end else '')  # Handle None values
-            if key not in event_groups:
-                event_groups[key] = []
-            event_groups[key].append(event_id)
-        
-        # Delete all but the lowest ID for each group
-        deleted_count = 0
-        for key, ids in event_groups.items():
-            if len(ids) > 1:
-                # Keep the lowest ID, delete the rest
-                id_to_keep = min(ids)
-                for id_to_delete in ids:
-                    if id_to_delete != id_to_keep:
-                        db.execute('DELETE FROM events WHERE id = ?', (id_to_delete,))
-                        deleted_count += 1
-        
-        # For characters, similar approach
-        cursor = db.execute('''
-            SELECT c1.id, c1.name, c1.element
-            FROM characters c1
-            JOIN (
-                SELECT name, element, COUNT(*) as count
-                FROM characters
-                GROUP BY name, element
-                HAVING count > 1
-            ) c2 ON c1.name = c2.name AND c1.element = c2.element
-            ORDER BY c1.name, c1.element, c1.id
-        ''')
-        chars_to_check = cursor.fetchall()
-        
-        # Group by content and keep only the lowest ID for each group
-        char_groups = {}
-        for char in chars_to_check:
-            char_id, name, element = char
-            key = (name, element)
-            if key not in char_groups:
-                char_groups[key] = []
-            char_groups[key].append(char_id)
-        
-        # Delete all but the lowest ID for each group
-        char_deleted_count = 0
-        for key, ids in char_groups.items():
-            if len(ids) > 1:
-                # Keep the lowest ID, delete the rest
-                id_to_keep = min(ids)
-                for id_to_delete in ids:
-                    if id_to_delete != id_to_keep:
-                        db.execute('DELETE FROM characters WHERE id = ?', (id_to_delete,))
-                        char_deleted_count += 1
-        
+    with _db_write_lock, get_db() as db:
+        # Both deletes share one write transaction, so there is a single commit
+        db.execute('BEGIN IMMEDIATE')
+        deleted_count, char_deleted_count = delete_duplicates(db)
         db.commit()
-        
+    invalidate_events_cache()
+    invalidate_characters_cache()
+
     return jsonify({
         "message": "Cleanup completed",
         "events_deleted": deleted_count,
@@ -352,166 +442,20 @@ def cleanup_duplicates():
 # ------------------- Run App -------------------
 if __name__ == '__main__':
     with app.app_context():  # Make sure we run the context
-        create_table()  # Ensure table exists before starting
-        
-        # Update data on startup
-        print("Updating events data from GBF Wiki...")
-        try:
-            # Call the function directly instead of through the route
-            url = "https://gbf.wiki/api.php"
-            headers = {
-                "User-Agent": "MyProjectBot/1.0 (contact@example.com)"
-            }
-            params = {
-                'action': 'cargoquery',
-                'format': 'json',
-                'tables': 'event_history',
-                'fields': 'name, time_start, time_end',
-                'order_by': 'time_start DESC',
-                'limit': '20'
-            }
-
-            response = requests.get(url, params=params, headers=headers)
-            if response.status_code == 200:
-                data = response.json()
-                events = [
-                    (
-                        event['title']['name'],
-                        event['title']['time start'],
-                        event['title'].get('time end', 'Ongoing')  # Handle missing end time
-                    )
-                    for event in data['cargoquery']
-                ]
-                
-                # Store in DB
-                save_events(events)
-                print(f"Successfully updated {len(events)} events")
-            else:
-                print(f"Failed to retrieve events data: {response.status_code}")
-        except Exception as e:
-            print(f"Error updating events data: {e}")
-            
-        print("Updating character data from GBF Wiki...")
-        try:
-            # Call the character update function directly
-            url = "https://gbf.wiki/api.php"
-            headers = {"User-Agent": "MyProjectBot/1.0 (contact@example.com)"}
-            params = {
-                'action': 'cargoquery',
-                'format': 'json',
-                'limit': '500',
-                'tables': 'characters, character_ratings',
-                'fields': 'characters.name, characters.element, character_ratings.gw_rating, '
-                        'character_ratings.gw_rating_grind, character_ratings.gw_rating_fa, '
-                        'character_ratings.gw_rating_hl',
-                'where': "characters.rarity='SSR'",
-                'join_on': 'characters.id=character_ratings.id',
-                'order_by': 'character_ratings.gw_rating+0 DESC'
-            }
-
-            response = requests.get(url, params=params, headers=headers)
-            if response.status_code == 200:
-                data = response.json()
-                characters = [
-                    (
-                        char['title']['name'],
-                        char['title']['element'],
-                        char['title'].get('gw rating') if char['title'].get('gw rating') else None,
-                        char['title'].get('gw rating grind') if char['title'].get('gw rating grind') else None,
-                        char['title'].get('gw rating fa') if char['title'].get('gw rating fa') else None,
-                        char['title'].get('gw rating hl') if char['title'].get('gw rating hl') else None
-                    )
-                    for char in data['cargoquery']
-                ]
-                
-                # Store in DB
-                save_characters(characters)
-                print(f"Successfully updated {len(characters)} characters")
-            else:
-                print(f"Failed to retrieve character data: {response.status_code}")
-        except Exception as e:
-            print(f"Error updating character data: {e}")
-            
-        # Clean up any duplicate entries that might exist
+        # Ensure tables exist before starting; this also removes any duplicate entries
         print("Cleaning up duplicate entries...")
-        try:
-            # Find duplicate events with different IDs
-            # Use IFNULL to properly handle NULL values in time_end
-            cursor = get_db().execute('''
-                SELECT e1.id, e1.name, e1.time_start, e1.time_end
-                FROM events e1
-                JOIN (
-                    SELECT name, time_start, IFNULL(time_end, '') as time_end, COUNT(*) as count
-                    FROM events
-                    GROUP BY name, time_start, IFNULL(time_end, '')
-                    HAVING count > 1
-                ) e2 ON e1.name = e2.name AND e1.time_start = e2.time_start AND IFNULL(e1.time_end, '') = e2.time_end
-                ORDER BY e1.name, e1.time_start, e1.id
-            ''')
-            events_to_check = cursor.fetchall()
-            
-            # Group by content and keep only the lowest ID for each group
-            event_groups = {}
-            for event in events_to_check:
-                event_id, name, time_start, time_end = event
-                key = (name, time_start, time_end if time_end else '')  # Handle None values
-                if key not in event_groups:
-                    event_groups[key] = []
-                event_groups[key].append(event_id)
-            
-            # Delete all but the lowest ID for each group
-            deleted_count = 0
-            for key, ids in event_groups.items():
-                if len(ids) > 1:
-                    # Keep the lowest ID, delete the rest
-                    id_to_keep = min(ids)
-                    for id_to_delete in ids:
-                        if id_to_delete != id_to_keep:
-                            get_db().execute('DELETE FROM events WHERE id = ?', (id_to_delete,))
-                            deleted_count += 1
-            
-            # Find duplicate characters with different IDs
-            cursor = get_db().execute('''
-                SELECT c1.id, c1.name, c1.element
-                FROM characters c1
-                JOIN (
-                    SELECT name, element, COUNT(*) as count
-                    FROM characters
-                    GROUP BY name, element
-                    HAVING count > 1
-                ) c2 ON c1.name = c2.name AND c1.element = c2.element
-                ORDER BY c1.name, c1.element, c1.id
-            ''')
-            chars_to_check = cursor.fetchall()
-            
-            # Group by content and keep only the lowest ID for each group
-            char_groups = {}
-            for char in chars_to_check:
-                char_id, name, element = char
-                key = (name, element)
-                if key not in char_groups:
-                    char_groups[key] = []
-                char_groups[key].append(char_id)
-            
-            # Delete all but the lowest ID for each group
-            char_deleted_count = 0
-            for key, ids in char_groups.items():
-                if len(ids) > 1:
-                    # Keep the lowest ID, delete the rest
-                    id_to_keep = min(ids)
-                    for id_to_delete in ids:
-                        if id_to_delete != id_to_keep:
-                            get_db().execute('DELETE FROM characters WHERE id = ?', (id_to_delete,))
-                            char_deleted_count += 1
-            
-            get_db().commit()
-            
-            if deleted_count > 0 or char_deleted_count > 0:
-                print(f"Cleanup completed: Removed {deleted_count} duplicate events and {char_deleted_count} duplicate characters")
-            else:
-                print("No duplicates found")
-        except Exception as e:
-            print(f"Error cleaning up duplicates: {e}")
-            
+        deleted_count, char_deleted_count = create_table()
+        if deleted_count > 0 or char_deleted_count > 0:
+            print(f"Cleanup completed: Removed {deleted_count} duplicate events and {char_deleted_count} duplicate characters")
+        else:
+            print("No duplicates found")
+
+    # Checkpoint the database on exit, including on the SIGTERM sent by docker stop
+    atexit.register(checkpoint_db)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Refresh wiki data in the background, starting right away
+    start_scheduler()
+
     # Start the Flask app
     app.run(host='0.0.0.0', port=5000)
@@ -1,8 +1,10 @@
 import sqlite3
 import requests
-import json
+import orjson
 import argparse
+import json
 import os
+import re
 
 # Mapping between user input (rating) and the corresponding database column
 focus_mapping = {
@@ -12,55 +14,68 @@ focus_mapping = {
     'high-level': 'gw_rating_hl'
 }
 
+# Values accepted for --element and --rating, and for the same keys in --batch queries
+ELEMENT_CHOICES = ['Fire', 'Water', 'Earth', 'Wind', 'Light', 'Dark']
+RATING_CHOICES = list(focus_mapping)
+
+# Shared keep-alive session for the Ollama chat API, reused by every request
+OLLAMA = requests.Session()
+OLLAMA.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+
+# Number of characters sent to the model when --limit is not given
+PROMPT_CHARACTER_LIMIT = 20
+
+# deepseek-r1 reasons inside <think>...</think> before answering
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+
 # Fetch character data from SQLite database
 def get_character_data(filter_element=None, filter_rating=None, limit=None):
-    conn = sqlite3.connect('events.db')
-    cursor = conn.cursor()
+    conn = sqlite3.connect(os.environ.get('DATABASE', 'events.db'))
+    conn.row_factory = sqlite3.Row
 
-    query = "SELECT * FROM characters WHERE 1=1"
-    
-    # Apply filters if they exist
-    if filter_element:
-        query += f" AND element = '{filter_element}'"
-    
-    # Apply rating filter if it exists, using the focus_mapping to get the correct column
-    if filter_rating and filter_rating in focus_mapping:
-        rating_column = focus_mapping[filter_rating]
-        query += f" AND {rating_column} IS NOT NULL"  # Ensure we filter out characters with no rating
-        query += f" ORDER BY {rating_column} DESC"  # Sort by the specified rating in descending order
-    else:
-        query += " ORDER BY gw_rating+0 DESC"  # Default sort by general rating
-    
-    # Limit the number of results if needed
-    if limit:
-        query += f" LIMIT {limit}"
+    # Only send the model what it ranks on: the name, element and the one rating
+    # being asked about, for the top rated characters. Without a rating type the
+    # general rating is used, as in the prompt.
+    rating_column = focus_mapping.get(filter_rating, focus_mapping['general'])
 
-    cursor.execute(query)
-    characters = cursor.fetchall()
-    conn.close()
+    # Values are bound as parameters so the query text, and SQLite's cached plan
+    # for it, is the same across calls. Only a column name taken from
+    # focus_mapping is ever placed in the SQL itself. The element condition is
+    # only added when filtering, so that query can use ix_chars_element.
+    element_clause = "element = ? AND " if filter_element else ""
+    query = f"""SELECT name, element, {rating_column} FROM characters
+                WHERE {element_clause}{rating_column} IS NOT NULL
+                ORDER BY {rating_column}+0 DESC
+                LIMIT ?"""
+    params = [filter_element] if filter_element else []
+    params.append(limit or PROMPT_CHARACTER_LIMIT)
 
     # Return character data as a list of dictionaries
-    columns = [desc[0] for desc in cursor.description]
-    return [dict(zip(columns, row)) for row in characters]
+    characters = [dict(row) for row in conn.execute(query, params)]
+    conn.close()
+    return characters
 
-# Send data to DeepSeek and get recommendations
-def get_deepseek_recommendations(characters_data, rating_type=None):
-    url = os.environ.get("DEEPSEEK_API_URL", "http://localhost:11434/api/chat")
-    
-    # Define explanations for each rating type
-    rating_explanations = {
-        'general': "General rating represents the character's overall usefulness in most content.",
-        'grind': "Grind rating represents how effective the character is for grinding repetitive content efficiently.",
-        'full-auto': "Full-auto rating represents how well the character performs when the game is played on automatic mode without manual inputs.",
-        'high-level': "High-level rating represents how valuable the character is for difficult endgame content."
-    }
+SYSTEM_PROMPT = "You are a helpful assistant that provides character recommendations for Granblue Fantasy based on game data. The ratings are on a scale from 1-10, with 10 being the best."
+
+# Define explanations for each rating type
+rating_explanations = {
+    'general': "General rating represents the character's overall usefulness in most content.",
+    'grind': "Grind rating represents how effective the character is for grinding repetitive content efficiently.",
+    'full-auto': "Full-auto rating represents how well the character performs when the game is played on automatic mode without manual inputs.",
+    'high-level': "High-level rating represents how valuable the character is for difficult endgame content."
+}
+
+# Build the user prompt for one set of characters and rating type
+def build_prompt(characters_data, rating_type=None):
+    # Serialize the (already top-K filtered) rows once for embedding in the prompt
+    characters_json = orjson.dumps(characters_data).decode()
     
     # Create a more specific prompt based on the rating type
     if rating_type and rating_type in focus_mapping:
         rating_column = focus_mapping[rating_type]
         explanation = rating_explanations.get(rating_type, "")
         
-        prompt = f"""Here is the character data: {json.dumps(characters_data)}. 
+        return f"""Here is the character data: {characters_json}. 
 
 I need recommendations for the top 3 characters specifically focusing on their '{rating_column}' values.
 
@@ -68,50 +83,153 @@ I need recommendations for the top 3 characters specifically focusing on their '
 
 Please prioritize characters with higher values in this specific rating category and explain why they excel in this area."""
     else:
-        prompt = f"""Here is the character data: {json.dumps(characters_data)}. 
+        return f"""Here is the character data: {characters_json}. 
 
 Please recommend the top 3 characters based on their overall ratings (gw_rating).
 
 The general rating represents a character's overall usefulness across different content types."""
+
+# Send a chat to DeepSeek and return the raw reply, reasoning included
+def request_chat(messages):
+    url = os.environ.get("DEEPSEEK_API_URL", "http://localhost:11434/api/chat")
     
     data = {
         "model": "deepseek-r1:1.5b",
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant that provides character recommendations for Granblue Fantasy based on game data. The ratings are on a scale from 1-10, with 10 being the best."},
-            {"role": "user", "content": prompt}
-        ],
+        "messages": messages,
         "stream": False
     }
     
-    headers = {"Content-Type": "application/json"}
-    
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    # orjson encodes straight to bytes, which requests sends as the body unchanged
+    response = OLLAMA.post(url, data=orjson.dumps(data))
     
     if response.status_code == 200:
         result = response.json()  # Parse the response as JSON
         #print("Raw response:", result)  # Add this line to print the response for debugging
         
-        message = result["message"]["content"]
-        
-        cleaned_message = message.replace("<think>", "").replace("</think>", "").strip()
-        
-        return cleaned_message
+        return result["message"]["content"]
     else:
         print("Error:", response.status_code, response.text)
         return None
 
+# Send a chat to DeepSeek and return the cleaned reply
+def send_chat(messages):
+    message = request_chat(messages)
+    if message is None:
+        return None
+    
+    cleaned_message = message.replace("<think>", "").replace("</think>", "").strip()
+    
+    return cleaned_message
+
+# Send data to DeepSeek and get recommendations
+def get_deepseek_recommendations(characters_data, rating_type=None):
+    return send_chat([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt(characters_data, rating_type)}
+    ])
+
+# Send several queries to DeepSeek in one chat and get one recommendation per query
+def get_deepseek_batch_recommendations(queries):
+    # queries is a list of (characters_data, rating_type) pairs
+    batch_instruction = (
+        f"You will receive {len(queries)} queries, each starting with 'Query <number>:'. "
+        "Answer every query independently. Return one JSON object per query, as a single JSON array "
+        'in query order, where each object looks like {"query": <number>, "recommendations": "<your answer>"}.'
+    )
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": batch_instruction}
+    ]
+    for number, (characters_data, rating_type) in enumerate(queries, start=1):
+        messages.append({"role": "user", "content": f"Query {number}: {build_prompt(characters_data, rating_type)}"})
+    
+    # The reasoning is kept in the reply so split_batch_reply can drop it whole
+    message = request_chat(messages)
+    if message is None:
+        return None
+    return split_batch_reply(message, len(queries))
+
+# Split a batched reply into a list with one recommendation (or None) per query
+def split_batch_reply(message, count):
+    # Brackets in the model's reasoning or its surrounding prose are not the answer,
+    # so drop the reasoning and take the first [...] that decodes to a list of objects
+    answer = THINK_BLOCK.sub("", message)
+    decoder = json.JSONDecoder()
+    replies = None
+    start = answer.find('[')
+    while start != -1:
+        try:
+            candidate, _ = decoder.raw_decode(answer, start)
+        except json.JSONDecodeError:
+            candidate = None
+        if isinstance(candidate, list) and candidate and all(isinstance(reply, dict) for reply in candidate):
+            replies = candidate
+            break
+        start = answer.find('[', start + 1)
+    if replies is None:
+        print("Could not split the batched reply, raw response:", message)
+        return [None] * count
+    
+    # Fall back to the list position only when the model numbered none of its replies,
+    # so an unnumbered reply can never overwrite another query's answer
+    numbered = any("query" in reply for reply in replies)
+    recommendations = [None] * count
+    for position, reply in enumerate(replies):
+        number = reply.get("query") if numbered else position + 1
+        if isinstance(number, int) and 1 <= number <= count:
+            recommendations[number - 1] = reply.get("recommendations")
+    return recommendations
+
 
 def main():
     # Command-line argument parsing
     parser = argparse.ArgumentParser(description="Get Granblue Fantasy character recommendations")
-    parser.add_argument('--element', type=str, choices=['Fire', 'Water', 'Earth', 'Wind', 'Light', 'Dark'], 
+    parser.add_argument('--element', type=str, choices=ELEMENT_CHOICES, 
                         help="Filter by element")
-    parser.add_argument('--rating', type=str, choices=['general', 'grind', 'full-auto', 'high-level'], 
+    parser.add_argument('--rating', type=str, choices=RATING_CHOICES, 
                         help="Filter by rating")
     parser.add_argument('--limit', type=int, help="Limit the number of characters to analyze")
+    parser.add_argument('--batch', type=str,
+                        help="Path to a JSON list of queries (objects with optional element, rating and limit) "
+                             "answered in a single request")
     
     args = parser.parse_args()
     
+    if args.batch:
+        with open(args.batch, 'rb') as f:
+            batch = orjson.loads(f.read())
+        
+        # Hold every query to the same rules argparse applies to the single-query flags
+        if not isinstance(batch, list):
+            parser.error("--batch: the file must contain a JSON list of queries")
+        for number, query in enumerate(batch, start=1):
+            if not isinstance(query, dict):
+                parser.error(f"--batch: query {number} is not an object")
+            if query.get('element') is not None and query['element'] not in ELEMENT_CHOICES:
+                parser.error(f"--batch: query {number}: invalid element {query['element']!r} "
+                             f"(choose from {', '.join(ELEMENT_CHOICES)})")
+            if query.get('rating') is not None and query['rating'] not in RATING_CHOICES:
+                parser.error(f"--batch: query {number}: invalid rating {query['rating']!r} "
+                             f"(choose from {', '.join(RATING_CHOICES)})")
+            limit = query.get('limit')
+            if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool)):
+                parser.error(f"--batch: query {number}: invalid limit {limit!r} (must be an integer)")
+        
+        # Fetch the character data for every query, then ask DeepSeek about all of them at once
+        queries = [
+            (get_character_data(query.get('element'), query.get('rating'), query.get('limit')), query.get('rating'))
+            for query in batch
+        ]
+        recommendations = get_deepseek_batch_recommendations(queries)
+        if recommendations is None:
+            return
+        
+        # Output the recommendations for each query
+        for query, recommendation in zip(batch, recommendations):
+            print('query:', query)
+            print('recommendations:', recommendation)
+        return
+    
     # Fetch character data from the SQLite database
     characters = get_character_data(args.element, args.rating, args.limit)
     
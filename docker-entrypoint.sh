@@ -1,10 +1,21 @@
 #!/bin/bash
 
+# Pass docker stop's SIGTERM on to both services, so the Flask app can
+# checkpoint its database before the container goes away
+trap 'kill -TERM $APP_PID $NOTIFIER_PID 2>/dev/null' TERM INT
+
 # Start the Flask app in the background
 python app.py &
+APP_PID=$!
 
 # Wait for Flask to start
 sleep 5
 
 # Start the event notifier
-python event_notifier.py 
\ No newline at end of file
+python event_notifier.py &
+NOTIFIER_PID=$!
+
+# Run until the notifier exits, then stop the Flask app and wait for both
+wait $NOTIFIER_PID
+kill -TERM $APP_PID 2>/dev/null
+wait
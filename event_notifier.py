@@ -1,19 +1,36 @@
 import paho.mqtt.client as mqtt
 import requests
+from requests.adapters import HTTPAdapter
+import ijson
+import itertools
 import json
+import math
+import orjson
+import queue
+import re
+import socket
 import time
 import datetime
+import functools
+import hashlib
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from dateutil import parser
 from dateutil import tz
 import os
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("event_notifier.log"), logging.StreamHandler()]
-)
+# Log calls only enqueue the record; a background listener thread owns the file
+# and console handlers, so disk and terminal I/O stay off the polling loop
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.FileHandler("event_notifier.log"), logging.StreamHandler()]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.Queue(-1)
+log_listener = QueueListener(_log_queue, *_log_handlers)
+log_listener.start()
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(QueueHandler(_log_queue))
 logger = logging.getLogger("event_notifier")
 
 # Configuration
@@ -30,6 +47,8 @@ MESSAGE_FORMAT = os.environ.get("MESSAGE_FORMAT", "human").lower()
 INCLUDE_EVENT_IDS = os.environ.get("INCLUDE_EVENT_IDS", "false").lower() == "true"
 
 CHECK_INTERVAL = 3600  # Check every hour (in seconds)
+ONE_DAY = 24 * 60 * 60  # "Ending soon" window (in seconds)
+THREE_DAYS = 3 * ONE_DAY  # "Starting soon" window (in seconds)
 
 # Define notification topics
 TOPIC_CURRENT_EVENTS = f"{MQTT_TOPIC_PREFIX}current"
@@ -37,34 +56,83 @@ TOPIC_UPCOMING_EVENTS = f"{MQTT_TOPIC_PREFIX}upcoming"
 TOPIC_ENDING_SOON = f"{MQTT_TOPIC_PREFIX}ending_soon"
 TOPIC_STARTING_SOON = f"{MQTT_TOPIC_PREFIX}starting_soon"
 
+# Topic, category key and log label for each published category
+PUBLISH_CATEGORIES = (
+    (TOPIC_CURRENT_EVENTS, "current", "current events"),
+    (TOPIC_UPCOMING_EVENTS, "upcoming", "upcoming events"),
+    (TOPIC_ENDING_SOON, "ending_soon", "events ending soon"),
+    (TOPIC_STARTING_SOON, "starting_soon", "events starting soon"),
+)
+PUBACK_TIMEOUT = 5  # Seconds to wait for the broker to acknowledge the publishes
+
+# Digest of the last payload queued on each topic, used to skip unchanged republishes
+_last_digests = {}
+
+# One keep-alive HTTP session reused by every poll of the API
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "gbf-event-notifier"})
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 # Define timezone info for JST
 TZINFOS = {"JST": tz.gettz("Asia/Tokyo")}
 
+# Date shapes emitted by the API, tried with strptime before falling back to dateutil
+_JST_SUFFIX = " JST"
+_DATE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S")
+
+# Parts of a date string left out of the human-readable messages
+_DATE_STRIP = re.compile(r" JST|2025-")
+
+# Line templates for one event in the human-readable messages
+_FMT_ONGOING = "• {idp}{name} (Starts: {s})".format
+_FMT_RANGE = "• {idp}{name}\n  {s} → {e}".format
+
+# Naive stand-in date for events with no (or an unparseable) date, e.g. "Ongoing"
+_FAR_FUTURE = datetime.datetime(9999, 1, 1)
+
 
 def on_connect(client, userdata, flags, rc):
     """Callback when connected to MQTT broker"""
     if rc == 0:
         logger.info("Connected to MQTT broker")
+        # Send the small PUBLISH frames right away instead of letting Nagle hold them back
+        sock = client.socket()
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The broker may have lost its retained messages, so publish everything again
+        _last_digests.clear()
     else:
-        logger.error(f"Failed to connect to MQTT broker with code {rc}")
+        logger.error("Failed to connect to MQTT broker with code %s", rc)
 
 
 def on_publish(client, userdata, mid):
     """Callback when message is published"""
-    logger.debug(f"Message {mid} published")
+    logger.debug("Message %s published", mid)
 
 
 def parse_event_date(date_str):
     """Parse date string to datetime object"""
+    # Results are cached by parse_event_ts, so the fallbacks must not depend on the current time
     try:
         if date_str is None or date_str == "":
             logger.warning("Empty date string, using far future date")
             # Make sure our default date is timezone naive
-            return datetime.datetime.now() + datetime.timedelta(days=365)
+            return _FAR_FUTURE
         
         if date_str == "Ongoing":
             # Set a far future date for ongoing events, timezone naive
-            return datetime.datetime.now() + datetime.timedelta(days=365)
+            return _FAR_FUTURE
+        
+        # Fast path for the usual "YYYY-MM-DD HH:MM[:SS] JST" shape. This gives the same
+        # naive JST wall-clock time as the dateutil fallback below
+        stripped = date_str[:-len(_JST_SUFFIX)] if date_str.endswith(_JST_SUFFIX) else date_str
+        for date_format in _DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(stripped, date_format)
+            except ValueError:
+                pass
         
         # Parse with timezone info
         dt = parser.parse(date_str, tzinfos=TZINFOS)
@@ -75,75 +143,92 @@ def parse_event_date(date_str):
             
         return dt
     except Exception as e:
-        logger.error(f"Error parsing date '{date_str}': {e}")
+        logger.error("Error parsing date '%s': %s", date_str, e)
         # Return a far future date as fallback
-        return datetime.datetime.now() + datetime.timedelta(days=365)
+        return _FAR_FUTURE
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_event_ts(date_str):
+    """Parse date string to a POSIX timestamp, cached per string"""
+    # Naive datetimes are read as local time, the same clock as time.time()
+    return parse_event_date(date_str).timestamp()
 
 
 def get_events():
-    """Fetch events from the API"""
+    """Fetch events from the API, yielding them one at a time as the body streams in"""
     try:
-        response = requests.get(f"{API_BASE_URL}/events")
-        if response.status_code == 200:
-            events = response.json()
-            
-            # Log the first event for debugging
-            if events and len(events) > 0:
-                logger.info(f"Sample event data: {json.dumps(events[0], indent=2)}")
-                
-            return events
-        else:
-            logger.error(f"API returned status code {response.status_code}")
-            return []
+        with SESSION.get(f"{API_BASE_URL}/events", timeout=10, stream=True) as response:
+            if response.status_code != 200:
+                logger.error("API returned status code %s", response.status_code)
+                return
+
+            # Let urllib3 undo any gzip encoding before ijson reads the raw stream
+            response.raw.decode_content = True
+            for index, event in enumerate(ijson.items(response.raw, "item", use_float=True)):
+                # Log the first event for debugging
+                if index == 0 and logger.isEnabledFor(logging.INFO):
+                    logger.info("Sample event data: %s", orjson.dumps(event, option=orjson.OPT_INDENT_2).decode())
+                yield event
     except Exception as e:
-        logger.error(f"Error fetching events: {e}")
-        return []
+        logger.error("Error fetching events: %s", e)
+        # Re-raise so a half-read list is never published as the full set of events
+        raise
 
 
 def categorize_events(events):
     """Categorize events into current, upcoming, ending soon, and starting soon"""
-    now = datetime.datetime.now()  # Use naive datetime
-    one_day_later = now + datetime.timedelta(days=1)
-    three_days_later = now + datetime.timedelta(days=3)
+    # Compare plain float timestamps rather than datetime objects
+    now = time.time()
+    one_day_later = now + ONE_DAY
+    three_days_later = now + THREE_DAYS
 
     current_events = []
     upcoming_events = []
     ending_soon = []
     starting_soon = []
 
+    count = 0
     for event in events:
+        count += 1
+        # Read each date field once and work with the locals from here on
+        time_start = event.get("time_start")
+        time_end = event.get("time_end")
+
         # Ensure time_start and time_end exist in the event data
-        if "time_start" not in event or event["time_start"] is None:
-            logger.warning(f"Event missing time_start field: {json.dumps(event)}")
+        if time_start is None:
+            logger.warning("Event missing time_start field: %s", json.dumps(event))
             continue
             
-        if "time_end" not in event or event["time_end"] is None:
-            logger.warning(f"Event missing time_end field, using 'Ongoing' as default")
-            event["time_end"] = "Ongoing"
+        if time_end is None:
+            logger.warning("Event missing time_end field, using 'Ongoing' as default")
+            time_end = event["time_end"] = "Ongoing"
 
         try:
-            start_time = parse_event_date(event["time_start"])
-            end_time = parse_event_date(event["time_end"])
-            
-            # Current events: started but not ended
-            if start_time <= now and end_time > now:
-                current_events.append(event)
-                
-                # Ending soon: current events ending within 24 hours
-                if end_time <= one_day_later:
-                    ending_soon.append(event)
+            start_time = parse_event_ts(time_start)
 
-            # Upcoming events: not started yet
-            elif start_time > now:
+            # Upcoming events: not started yet, so the end date is never needed
+            if start_time > now:
                 upcoming_events.append(event)
                 
                 # Starting soon: upcoming events starting within 3 days
                 if start_time <= three_days_later:
                     starting_soon.append(event)
+                continue
+
+            # Current events: started but not ended
+            end_time = parse_event_ts(time_end)
+            if end_time > now:
+                current_events.append(event)
+                
+                # Ending soon: current events ending within 24 hours
+                if end_time <= one_day_later:
+                    ending_soon.append(event)
         except Exception as e:
-            logger.error(f"Error categorizing event {event['name'] if 'name' in event else 'unknown'}: {e}")
+            logger.error("Error categorizing event %s: %s", event.get('name', 'unknown'), e)
             continue
 
+    logger.info("Found %d events from API", count)
     return {
         "current": current_events,
         "upcoming": upcoming_events,
@@ -152,13 +237,36 @@ def categorize_events(events):
     }
 
 
-def format_events(events):
+def next_transition(categorized_events):
+    """Return the earliest future timestamp an event changes category, or None"""
+    now = time.time()
+    transitions = []
+    
+    # Current events become "ending soon" a day before they end, then stop being current
+    for event in categorized_events["current"]:
+        end_time = parse_event_ts(event["time_end"])
+        transitions += [end_time - ONE_DAY, end_time]
+
+    # Upcoming events become "starting soon" three days before they start, then current
+    for event in categorized_events["upcoming"]:
+        start_time = parse_event_ts(event["time_start"])
+        transitions += [start_time - THREE_DAYS, start_time]
+
+    return min((moment for moment in transitions if moment > now), default=None)
+
+
+def format_events(events, lines=None):
     """Format events to be more compact and readable"""
+    # lines, if given, maps id(event) to its formatted line and is filled in as
+    # events are formatted, so calls sharing it format each event only once
     if not events:
         return "No events"
         
     formatted = []
     for event in events:
+        if lines is not None and id(event) in lines:
+            formatted.append(lines[id(event)])
+            continue
         try:
             # Extract only essential information
             name = event.get("name", "Unnamed")
@@ -170,67 +278,93 @@ def format_events(events):
             
             # Format dates to be more concise
             if isinstance(start, str):
-                start = start.replace(" JST", "")
-                if "2025-" in start:
-                    start = start.replace("2025-", "")
+                start = _DATE_STRIP.sub("", start)
                     
             if isinstance(end, str):
-                end = end.replace(" JST", "")
-                if "2025-" in end:
-                    end = end.replace("2025-", "")
+                end = _DATE_STRIP.sub("", end)
             
             # Include ID if configured
             id_prefix = f"[{event_id}] " if INCLUDE_EVENT_IDS and event_id else ""
             
             # Format differently depending on if it's "Ongoing" or not
             if end == "Ongoing":
-                formatted.append(f"• {id_prefix}{name} (Starts: {start})")
+                formatted.append(_FMT_ONGOING(idp=id_prefix, name=name, s=start))
             else:
-                formatted.append(f"• {id_prefix}{name}\n  {start} → {end}")
+                formatted.append(_FMT_RANGE(idp=id_prefix, name=name, s=start, e=end))
         except Exception as e:
-            logger.error(f"Error formatting event: {e}")
+            logger.error("Error formatting event: %s", e)
             # Add basic info for problematic event
             formatted.append(f"• Error formatting event: {event.get('name', 'Unknown event')}")
+        if lines is not None:
+            lines[id(event)] = formatted[-1]
         
     return "\n".join(formatted)
 
 
 def publish_events(client, categorized_events):
-    """Publish events to their respective MQTT topics"""
+    """Publish events to their respective MQTT topics, returning the publishes still awaiting a PUBACK"""
     
     # Determine which format to use
     use_json = MESSAGE_FORMAT == "json"
-    
-    # Publish current events
-    payload = json.dumps(categorized_events["current"]) if use_json else format_events(categorized_events["current"])
-    client.publish(TOPIC_CURRENT_EVENTS, payload, qos=1, retain=True)
-    logger.info(f"Published {len(categorized_events['current'])} current events")
 
-    # Publish upcoming events
-    payload = json.dumps(categorized_events["upcoming"]) if use_json else format_events(categorized_events["upcoming"])
-    client.publish(TOPIC_UPCOMING_EVENTS, payload, qos=1, retain=True)
-    logger.info(f"Published {len(categorized_events['upcoming'])} upcoming events")
+    # Every event is serialized (or formatted) once and its bytes or line reused
+    # for each list it is in: ending_soon repeats current, starting_soon upcoming
+    encoded = {}
+    lines = {}
+    
+    # Build every payload up front so nothing runs between the publishes below.
+    # Payloads identical to the last one published are skipped: the broker still
+    # holds that retained message for new subscribers.
+    payloads = []
+    for topic, category, label in PUBLISH_CATEGORIES:
+        events = categorized_events[category]
+        if use_json:
+            for event in events:
+                if id(event) not in encoded:
+                    encoded[id(event)] = orjson.dumps(event)
+            # Same bytes orjson.dumps(events) would produce
+            payload = b"[" + b",".join([encoded[id(event)] for event in events]) + b"]"
+        else:
+            payload = format_events(events, lines)
+        digest = hashlib.blake2b(payload if isinstance(payload, bytes) else payload.encode(), digest_size=16).digest()
+        if digest == _last_digests.get(topic):
+            logger.debug("Skipping %s, %s unchanged", topic, label)
+            continue
+        payloads.append((topic, payload, len(events), label, digest))
+
+    # Queue the publishes in one burst so the network thread can write the
+    # frames together and their PUBACKs overlap on the wire
+    infos = [(topic, digest, client.publish(topic, payload, qos=1, retain=True))
+             for topic, payload, _, _, digest in payloads]
+    if payloads:
+        logger.info("Published %s", ", ".join(f"{count} {label}" for _, _, count, label, _ in payloads))
+
+    pending = []
+    for topic, digest, info in infos:
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error("Failed to publish to %s: %s", topic, mqtt.error_string(info.rc))
+            continue
+        _last_digests[topic] = digest
+        pending.append((topic, info))
+    return pending
 
-    # Publish events ending soon
-    payload = json.dumps(categorized_events["ending_soon"]) if use_json else format_events(categorized_events["ending_soon"])
-    client.publish(TOPIC_ENDING_SOON, payload, qos=1, retain=True)
-    logger.info(f"Published {len(categorized_events['ending_soon'])} events ending soon")
 
-    # Publish events starting soon
-    payload = json.dumps(categorized_events["starting_soon"]) if use_json else format_events(categorized_events["starting_soon"])
-    client.publish(TOPIC_STARTING_SOON, payload, qos=1, retain=True)
-    logger.info(f"Published {len(categorized_events['starting_soon'])} events starting soon")
+def wait_for_publishes(pending):
+    """Wait for the broker to acknowledge the publishes returned by publish_events"""
+    for topic, info in pending:
+        info.wait_for_publish(timeout=PUBACK_TIMEOUT)
+        if not info.is_published():
+            logger.warning("No acknowledgement for %s within %s seconds", topic, PUBACK_TIMEOUT)
 
 
 def main():
     """Main function to run the event notifier"""
     # Log configuration
-    logger.info("Configuration:")
-    logger.info(f"- API Base URL: {API_BASE_URL}")
-    logger.info(f"- MQTT Broker: {MQTT_BROKER}:{MQTT_PORT}")
-    logger.info(f"- Check Interval: {CHECK_INTERVAL} seconds")
-    logger.info(f"- Message Format: {MESSAGE_FORMAT}")
-    logger.info(f"- Include Event IDs: {INCLUDE_EVENT_IDS}")
+    logger.info(
+        "Configuration:\n- API Base URL: %s\n- MQTT Broker: %s:%s\n- Check Interval: %s seconds"
+        "\n- Message Format: %s\n- Include Event IDs: %s",
+        API_BASE_URL, MQTT_BROKER, MQTT_PORT, CHECK_INTERVAL, MESSAGE_FORMAT, INCLUDE_EVENT_IDS
+    )
     
     # Set up MQTT client
     client = mqtt.Client(client_id=MQTT_CLIENT_ID)
@@ -243,67 +377,85 @@ def main():
 
     try:
         # Connect to broker
-        logger.info(f"Connecting to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
+        logger.info("Connecting to MQTT broker at %s:%s", MQTT_BROKER, MQTT_PORT)
         client.connect(MQTT_BROKER, MQTT_PORT, 60)
         
         # Start the loop
         client.loop_start()
 
         while True:
+            # Sleep a full interval unless an event changes category sooner
+            sleep_seconds = CHECK_INTERVAL
             try:
                 # Fetch events
                 logger.info("Fetching events from API")
                 events = get_events()
+                first_event = next(events, None)
                 
-                if events:
-                    # Categorize events
-                    logger.info(f"Found {len(events)} events from API")
-                    categorized_events = categorize_events(events)
+                if first_event is not None:
+                    # Categorize events as they are parsed off the response
+                    categorized_events = categorize_events(itertools.chain((first_event,), events))
                     
                     # Show counts
-                    logger.info(f"Event counts by category:")
-                    logger.info(f"- Current events: {len(categorized_events['current'])}")
-                    logger.info(f"- Upcoming events: {len(categorized_events['upcoming'])}")
-                    logger.info(f"- Ending soon: {len(categorized_events['ending_soon'])}")
-                    logger.info(f"- Starting soon: {len(categorized_events['starting_soon'])}")
+                    logger.info(
+                        "Event counts by category:\n- Current events: %d\n- Upcoming events: %d"
+                        "\n- Ending soon: %d\n- Starting soon: %d",
+                        len(categorized_events['current']), len(categorized_events['upcoming']),
+                        len(categorized_events['ending_soon']), len(categorized_events['starting_soon'])
+                    )
                     
-                    # Publish to MQTT topics
-                    publish_events(client, categorized_events)
+                    # Publish to MQTT topics. The PUBACKs arrive on the network thread
+                    # while the logging below runs, and are only waited for at the end
+                    pending = publish_events(client, categorized_events)
                     
                     # Log samples of the formatted output if human format is used
                     if MESSAGE_FORMAT == "human" and categorized_events["current"]:
                         sample_output = format_events([categorized_events["current"][0]])
-                        logger.info(f"Sample formatted output:\n{sample_output}")
+                        logger.info("Sample formatted output:\n%s", sample_output)
                     
                     # Log important notifications
                     if categorized_events["ending_soon"]:
-                        logger.info("ALERT: Events ending in 24 hours:")
-                        for event in categorized_events["ending_soon"]:
-                            logger.info(f"  - {event['name'] if 'name' in event else 'unnamed'} (ends: {event['time_end']})")
+                        logger.info("ALERT: Events ending in 24 hours:\n%s", "\n".join(
+                            f"  - {event.get('name', 'unnamed')} (ends: {event['time_end']})"
+                            for event in categorized_events["ending_soon"]
+                        ))
                     
                     if categorized_events["starting_soon"]:
-                        logger.info("NOTICE: Events starting in 3 days:")
-                        for event in categorized_events["starting_soon"]:
-                            logger.info(f"  - {event['name'] if 'name' in event else 'unnamed'} (starts: {event['time_start']})")
+                        logger.info("NOTICE: Events starting in 3 days:\n%s", "\n".join(
+                            f"  - {event.get('name', 'unnamed')} (starts: {event['time_start']})"
+                            for event in categorized_events["starting_soon"]
+                        ))
+                    
+                    # Wake up right after the next event crosses a category boundary
+                    transition = next_transition(categorized_events)
+                    if transition is not None:
+                        seconds_left = transition - time.time()
+                        sleep_seconds = min(CHECK_INTERVAL, math.ceil(seconds_left) + 1)
+
+                    # Only now block on whatever acknowledgements are still outstanding
+                    wait_for_publishes(pending)
                 else:
                     logger.warning("No events returned from API")
             except Exception as e:
-                logger.error(f"Error in main loop: {e}")
+                logger.error("Error in main loop: %s", e)
                 # Continue despite errors in the main processing loop
             
-            # Wait for next check interval
-            logger.info(f"Next check in {CHECK_INTERVAL} seconds")
-            time.sleep(CHECK_INTERVAL)
+            # Wait for next check
+            logger.info("Next check in %s seconds", sleep_seconds)
+            time.sleep(sleep_seconds)
             
     except KeyboardInterrupt:
         logger.info("Script terminated by user")
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
     finally:
         # Clean up
         client.loop_stop()
         client.disconnect()
+        SESSION.close()
         logger.info("Disconnected from MQTT broker")
+        # Flush the remaining log records before exiting
+        log_listener.stop()
 
 
 if __name__ == "__main__":